@@ -16,8 +16,8 @@ bmp_dir = "./BMP_files"
 
 
 # Function of dicom2jpg package to convert DICOM files from DICOM_files folder to BMP and store in BMP_files folder.
-def dicom2bmp(origin, target_root=None, multiprocessing=True):
-    return _dicom_convertor(origin, target_root, multiprocessing=multiprocessing)
+def dicom2bmp(origin, target_root=None, multiprocessing=True, max_workers=None):
+    return _dicom_convertor(origin, target_root, multiprocessing=multiprocessing, max_workers=max_workers)
 
 
 if __name__ == '__main__':
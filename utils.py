@@ -14,109 +14,290 @@ import numpy as np
 from pathlib import Path
 import os
 import concurrent.futures
+import struct
+
+# Only the elements needed to decode, window and name each image are parsed
+_REQUIRED_TAGS = [
+    'SOPClassUID', 'SeriesNumber', 'InstanceNumber',
+    'SamplesPerPixel', 'PhotometricInterpretation', 'PlanarConfiguration', 'NumberOfFrames',
+    'Rows', 'Columns', 'BitsAllocated', 'BitsStored', 'HighBit', 'PixelRepresentation',
+    'WindowCenter', 'WindowWidth', 'RescaleIntercept', 'RescaleSlope', 'RescaleType', 'VOILUTFunction',
+    'ModalityLUTSequence', 'VOILUTSequence', 'PixelData', 'FloatPixelData', 'DoubleFloatPixelData',
+]
+
+# Unsupported SOP classes by UID
+_UNSUPPORTED_SOP_CLASSES = {
+    '1.2.840.10008.5.1.4.1.1.104.1': 'Encapsulated PDF Storage',
+    '1.2.840.10008.5.1.4.1.1.88.59': 'Key Object Selection Document',
+}
+
+# Attributes that, together with the stored value range, fully determine a
+# stored value -> uint8 table for images on the LUT fast path
+_LUT_KEYWORDS = (
+    'BitsStored', 'PixelRepresentation', 'RescaleSlope', 'RescaleIntercept',
+    'WindowCenter', 'WindowWidth', 'VOILUTFunction', 'PhotometricInterpretation',
+)
+_LUT_CACHE_SIZE = 64
+_LUT_CACHE = {}
+
+# Output directory of a worker process, set once by _init_worker
+_worker_target_root = None
+
+# Identity grey palette (BGRA entries) for 8-bit BMP files
+_BMP_GRAYSCALE_PALETTE = np.column_stack([np.arange(256)] * 3 + [np.zeros(256)]).astype(np.uint8).tobytes()
 
 
 def _is_unsupported(ds):
     # Exclude unsupported SOP classes by UID
-    if ds.SOPClassUID == '1.2.840.10008.5.1.4.1.1.104.1':
-        return 'Encapsulated PDF Storage'
-    elif ds.SOPClassUID == '1.2.840.10008.5.1.4.1.1.88.59':
-        return 'Key Object Selection Document'
-    else:
-        return False
+    return _UNSUPPORTED_SOP_CLASSES.get(str(ds.SOPClassUID), False)
+
+
+def _min_max(pixel_array):
+    # cv2.minMaxLoc finds both extremes in a single vectorized pass, but only
+    # handles single-channel images, so fall back to NumPy for color data
+    if pixel_array.ndim == 2 and pixel_array.dtype in (np.uint8, np.uint16, np.int16, np.float32, np.float64):
+        pixel_min, pixel_max, _, _ = cv2.minMaxLoc(pixel_array)
+        return pixel_min, pixel_max
+    return pixel_array.min(), pixel_array.max()
+
+
+def _is_lut_eligible(ds, pixel_array):
+    # Integer grayscale images whose modality and VOI steps are monotonic
+    # (rescale and window/level, no LUT sequences) can be mapped through a
+    # precomputed stored value -> uint8 table
+    return (pixel_array.ndim == 2
+            and pixel_array.dtype in (np.uint8, np.uint16, np.int16)
+            and ds.get('BitsStored', 16) <= 16
+            and 'ModalityLUTSequence' not in ds
+            and 'VOILUTSequence' not in ds)
 
 
 def _pixel_process(ds, pixel_array):
+    if _is_lut_eligible(ds, pixel_array):
+        return _pixel_process_lut(ds, pixel_array)
+
+    return _pixel_transform(ds, pixel_array.astype(np.float32, copy=False))
+
+
+def _pixel_process_lut(ds, pixel_array):
+    stored_min, stored_max = _min_max(pixel_array)
+    lut = _get_lut(ds, pixel_array.dtype, int(stored_min), int(stored_max))
+
+    if pixel_array.dtype == np.uint8:
+        return cv2.LUT(pixel_array, lut)
+
+    # Index 16-bit data through its unsigned bit pattern so signed images need no offset pass
+    return lut[pixel_array.view(np.uint16)]
+
+
+def _get_lut(ds, dtype, stored_min, stored_max):
+    # Slices of a series usually share their rescale/window attributes and
+    # often their stored range too, so each worker keeps the tables it built
+    key = (dtype.str, stored_min, stored_max) + tuple(str(ds.get(keyword)) for keyword in _LUT_KEYWORDS)
+    lut = _LUT_CACHE.get(key)
+    if lut is not None:
+        return lut
+
+    # Run the float pipeline once over every stored value between the image
+    # extremes; as the pipeline is monotonic its min/max match the image's
+    stored_values = np.arange(stored_min, stored_max + 1)
+    lut_values = _pixel_transform(ds, stored_values.astype(np.float32))
+
+    lut = np.zeros(256 if dtype == np.uint8 else 1 << 16, dtype=np.uint8)
+    lut[stored_values.astype(dtype).view(np.uint8 if dtype == np.uint8 else np.uint16)] = lut_values
+
+    if len(_LUT_CACHE) >= _LUT_CACHE_SIZE:
+        _LUT_CACHE.clear()
+    _LUT_CACHE[key] = lut
+    return lut
+
+
+def _pixel_transform(ds, pixel_array):
+    if 'RescaleSlope' in ds and 'RescaleIntercept' in ds and 'WindowCenter' in ds and 'WindowWidth' in ds \
+            and not ('VOILUTFunction' in ds and ds.VOILUTFunction == 'SIGMOID'):
+        return _pixel_transform_linear(ds, pixel_array)
+
     # Step 1: Modality LUT (Rescale slope/intercept)
     if 'RescaleSlope' in ds and 'RescaleIntercept' in ds:
-        rescale_slope = float(ds.RescaleSlope)
-        rescale_intercept = float(ds.RescaleIntercept)
+        rescale_slope = np.float32(float(ds.RescaleSlope))
+        rescale_intercept = np.float32(float(ds.RescaleIntercept))
         pixel_array = pixel_array * rescale_slope + rescale_intercept
     else:
-        pixel_array = apply_modality_lut(pixel_array, ds)
+        # apply_modality_lut may promote to float64, keep the pipeline in float32
+        pixel_array = apply_modality_lut(pixel_array, ds).astype(np.float32, copy=False)
 
     # Step 2: VOI LUT (Window/Level)
     if 'VOILUTFunction' in ds and ds.VOILUTFunction == 'SIGMOID':
-        pixel_array = apply_voi_lut(pixel_array, ds)
+        pixel_array = apply_voi_lut(pixel_array, ds).astype(np.float32, copy=False)
     elif 'WindowCenter' in ds and 'WindowWidth' in ds:
-        window_center = ds.WindowCenter
-        window_width = ds.WindowWidth
-
-        # Handle multi-value fields
-        if type(window_center) == pydicom.multival.MultiValue:
-            window_center = float(window_center[0])
-        else:
-            window_center = float(window_center)
-        if type(window_width) == pydicom.multival.MultiValue:
-            window_width = float(window_width[0])
-        else:
-            window_width = float(window_width)
-
+        window_center, window_width = _get_window(ds)
         pixel_array = _get_LUT_value_LINEAR_EXACT(pixel_array, window_width, window_center)
     else:
-        pixel_array = apply_voi_lut(pixel_array, ds)
+        pixel_array = apply_voi_lut(pixel_array, ds).astype(np.float32, copy=False)
+
+    # Step 3: Presentation LUT - normalize to 8 bit as a single in-place affine transform
+    pixel_min, pixel_max = _min_max(pixel_array)
+    scale, offset = _get_presentation_coefficients(ds, pixel_min, pixel_max)
+
+    np.multiply(pixel_array, scale, out=pixel_array)
+    np.add(pixel_array, offset, out=pixel_array)
+    np.clip(pixel_array, 0, 255, out=pixel_array)
+
+    return pixel_array.astype(np.uint8, copy=False)
+
+
+def _pixel_transform_linear(ds, pixel_array):
+    # Rescale, LINEAR_EXACT window and presentation LUT are all monotonic affine
+    # maps with clipping, so together they reduce to one affine transform clipped
+    # to [0, 255] whose coefficients only depend on the image extremes
+    rescale_slope = np.float32(float(ds.RescaleSlope))
+    rescale_intercept = np.float32(float(ds.RescaleIntercept))
+    window_center, window_width = _get_window(ds)
+
+    stored_min, stored_max = _min_max(pixel_array)
+    data_min, data_max = sorted((stored_min * rescale_slope + rescale_intercept,
+                                 stored_max * rescale_slope + rescale_intercept))
+    data_range = data_max - data_min
+    a = data_range / window_width
+    b = data_min + data_range * (0.5 - window_center / window_width)
+
+    # Extremes of the windowed image, reached at the extremes of the rescaled data
+    pixel_min = min(max(data_min * a + b, data_min), data_max)
+    pixel_max = min(max(data_max * a + b, data_min), data_max)
+    scale, offset = _get_presentation_coefficients(ds, pixel_min, pixel_max)
+
+    gain = np.float32(rescale_slope * a * scale)
+    bias = np.float32((rescale_intercept * a + b) * scale + offset)
+
+    pixel_array = pixel_array * gain
+    np.add(pixel_array, bias, out=pixel_array)
+    np.clip(pixel_array, 0, 255, out=pixel_array)
+
+    return pixel_array.astype(np.uint8, copy=False)
 
-    # Step 3: Presentation LUT - normalize to 8 bit
-    pixel_array = ((pixel_array - pixel_array.min()) / (pixel_array.max() - pixel_array.min())) * 255.0
 
-    # Handle MONOCHROME1 (invert for X-rays, etc.)
+def _get_window(ds):
+    return _first_float(ds.WindowCenter), _first_float(ds.WindowWidth)
+
+
+def _first_float(value):
+    # Handle multi-value fields
+    return np.float32(float(value[0] if isinstance(value, pydicom.multival.MultiValue) else value))
+
+
+def _get_presentation_coefficients(ds, pixel_min, pixel_max):
+    # A constant image has no range to stretch, map it to a flat image
+    scale = 255.0 / (pixel_max - pixel_min) if pixel_max > pixel_min else 0.0
+
+    # Handle MONOCHROME1 (invert for X-rays, etc.) by folding the inversion into the coefficients
     if 'PhotometricInterpretation' in ds and ds.PhotometricInterpretation == "MONOCHROME1":
-        pixel_array = np.max(pixel_array) - pixel_array
+        scale = -scale
+        offset = 255.0 - pixel_min * scale
+    else:
+        offset = -pixel_min * scale
 
-    return pixel_array.astype('uint8')
+    return scale, offset
 
 
 def _get_LUT_value_LINEAR_EXACT(data, window, level):
-    data_min = data.min()
-    data_max = data.max()
+    data_min, data_max = _min_max(data)
     data_range = data_max - data_min
 
-    data = np.piecewise(data,
-                        [data <= (level - (window) / 2),
-                         data > (level + (window) / 2)],
-                        [data_min, data_max,
-                         lambda data: ((data - level + window / 2) / window * data_range) + data_min])
+    # The linear window is monotonic, so applying it everywhere and clipping to
+    # [data_min, data_max] matches the piecewise definition in a single pass
+    a = data_range / window
+    b = data_min + data_range * (0.5 - level / window)
+
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float32)
+    np.multiply(data, a, out=data)
+    np.add(data, b, out=data)
+    np.clip(data, data_min, data_max, out=data)
     return data
 
 
-def _ds_to_file(file_path, target_root):
-    try:
-        # Read DICOM file
-        ds = pydicom.dcmread(file_path, force=True)
+class _UnsupportedImageError(Exception):
+    pass
+
+
+def _read_ds(file_path):
+    # Read DICOM file
+    ds = pydicom.dcmread(file_path, force=True, specific_tags=_REQUIRED_TAGS)
+
+    # Check if supported
+    is_unsupported = _is_unsupported(ds)
+    if is_unsupported:
+        raise _UnsupportedImageError(f'{is_unsupported} is currently not supported')
+
+    return ds
+
+
+def _process(ds):
+    # Load pixel array
+    pixel_array = ds.pixel_array
+
+    # Check for multiframe (not supported in this simple version)
+    if len(pixel_array.shape) == 3 and pixel_array.shape[2] != 3:
+        raise _UnsupportedImageError('Multiframe images are currently not supported')
+
+    # Palette indices would otherwise be written out as a grayscale image
+    if 'PhotometricInterpretation' in ds and ds.PhotometricInterpretation == 'PALETTE COLOR':
+        raise _UnsupportedImageError('PALETTE COLOR images are currently not supported')
 
-        # Check if supported
-        is_unsupported = _is_unsupported(ds)
-        if is_unsupported:
-            return f'{file_path} cannot be converted.\n{is_unsupported} is currently not supported'
+    # Process pixel data
+    pixel_array = _pixel_process(ds, pixel_array)
 
-        # Load pixel array
-        pixel_array = ds.pixel_array.astype(float)
+    # Handle color images (convert RGB to BGR for OpenCV)
+    if pixel_array.ndim == 3 and 'PhotometricInterpretation' in ds and ds.PhotometricInterpretation in \
+            ['YBR_RCT', 'RGB', 'YBR_ICT', 'YBR_PARTIAL_420', 'YBR_FULL_422', 'YBR_FULL']:
+        pixel_array = cv2.cvtColor(pixel_array, cv2.COLOR_RGB2BGR)
 
-        # Check for multiframe (not supported in this simple version)
-        if len(pixel_array.shape) == 3 and pixel_array.shape[2] != 3:
-            return f'{file_path} cannot be converted.\nMultiframe images are currently not supported'
+    return pixel_array
 
-        # Process pixel data
-        pixel_array = _pixel_process(ds, pixel_array)
 
-        # Handle color images (convert RGB to BGR for OpenCV)
-        if 'PhotometricInterpretation' in ds and ds.PhotometricInterpretation in \
-                ['YBR_RCT', 'RGB', 'YBR_ICT', 'YBR_PARTIAL_420', 'YBR_FULL_422', 'YBR_FULL', 'PALETTE COLOR']:
-            pixel_array[:, :, [0, 2]] = pixel_array[:, :, [2, 0]]
+def _encode_bmp(pixel_array):
+    # BMP is a fixed header plus raw bottom-up rows padded to 4 bytes, grayscale
+    # images are stored as 8-bit palette BMP and color images as 24-bit BGR
+    height, width = pixel_array.shape[:2]
+    channels = 1 if pixel_array.ndim == 2 else pixel_array.shape[2]
+    row_size = width * channels
+    padding = -row_size % 4
+    palette = _BMP_GRAYSCALE_PALETTE if channels == 1 else b''
+    pixel_offset = 14 + 40 + len(palette)
+    file_size = pixel_offset + (row_size + padding) * height
 
-        # Generate output file path
-        full_export_fp_fn = _get_export_file_path(ds, file_path, target_root)
+    file_header = struct.pack('<2sIHHI', b'BM', file_size, 0, 0, pixel_offset)
+    info_header = struct.pack('<IiiHHIIiiII', 40, width, height, 1, channels * 8, 0, 0, 0, 0, 0, 0)
 
-        # Create output directory
-        Path.mkdir(full_export_fp_fn.parent, exist_ok=True, parents=True)
+    rows = pixel_array[::-1].reshape(height, row_size)
+    if padding:
+        rows = np.pad(rows, ((0, 0), (0, padding)))
 
-        # Write BMP file
-        cv2.imwrite(str(full_export_fp_fn), pixel_array)
+    return file_header + info_header + palette + rows.tobytes()
 
-        return True
+
+def _write(pixel_array, full_export_fp_fn):
+    # Write BMP file (the output directory is created once by _dicom_convertor)
+    full_export_fp_fn.write_bytes(_encode_bmp(pixel_array))
+
+
+def _error_message(file_path, reason, unsupported):
+    if unsupported:
+        return f'{file_path} cannot be converted.\n{reason}'
+    return f'Error converting {file_path}: {reason}'
+
+
+def _ds_to_file(file_path, target_root):
+    # Returns None on success or a (file_path, reason, unsupported) failure, formatted by the caller
+    try:
+        ds = _read_ds(file_path)
+        pixel_array = _process(ds)
+        _write(pixel_array, _get_export_file_path(ds, file_path, target_root))
+        return None
 
     except Exception as e:
-        return f'Error converting {file_path}: {str(e)}'
+        # Keep only the message, the exception's traceback would pin the dataset and pixel data
+        return file_path, str(e), isinstance(e, _UnsupportedImageError)
 
 
 def _get_export_file_path(ds, file_path, target_root):
@@ -137,6 +318,23 @@ def _get_export_file_path(ds, file_path, target_root):
     return full_export_fp_fn
 
 
+def _scan_dicom_files(directory):
+    # Recursive os.scandir walk, reusing the cached directory entry types
+    # instead of issuing a stat call per file
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        # Skip directories that cannot be listed, as os.walk does
+        return
+
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_dicom_files(entry.path)
+            elif entry.name[-4:].lower() == '.dcm' and entry.is_file():
+                yield entry.path
+
+
 def _get_root_get_dicom_file_list(origin_input, target_root):
     # Handle different input types
     if isinstance(origin_input, list) or isinstance(origin_input, tuple):
@@ -155,16 +353,12 @@ def _get_root_get_dicom_file_list(origin_input, target_root):
             if origin.suffix.lower() != '.dcm':
                 raise Exception('Input file type should be a DICOM file')
             else:
-                dicom_file_list.append(origin)
+                dicom_file_list.append(str(origin))
         elif origin.is_dir():
             # Find all .dcm files in directory and subdirectories
-            for root, sub_f, files in os.walk(origin):
-                for f in files:
-                    if f.lower().endswith('.dcm'):
-                        file_path_dcm = Path(root) / Path(f)
-                        dicom_file_list.append(file_path_dcm)
+            dicom_file_list.extend(_scan_dicom_files(str(origin)))
 
-    # Sort file list
+    # Sort file list (plain strings compare faster than Path objects)
     dicom_file_list.sort()
 
     # Set target root directory
@@ -179,7 +373,21 @@ def _get_root_get_dicom_file_list(origin_input, target_root):
     return root_folder, dicom_file_list
 
 
-def _dicom_convertor(origin, target_root=None, multiprocessing=True):
+def _init_worker(target_root):
+    # Runs once per worker process, so tasks only need to carry the file path
+    global _worker_target_root
+    _worker_target_root = target_root
+
+    # Parallelism comes from the process pool, keep OpenCV single threaded in
+    # each worker so processes do not oversubscribe the cores
+    cv2.setNumThreads(1)
+
+
+def _ds_to_file_in_worker(file_path):
+    return _ds_to_file(file_path, _worker_target_root)
+
+
+def _dicom_convertor(origin, target_root=None, multiprocessing=True, max_workers=None):
     # Get target directory and list of DICOM files
     target_root, dicom_file_list = _get_root_get_dicom_file_list(origin, target_root)
 
@@ -189,28 +397,36 @@ def _dicom_convertor(origin, target_root=None, multiprocessing=True):
 
     print(f"Found {len(dicom_file_list)} DICOM files to convert...")
 
+    # Create output directory, all files are exported flat into target_root
+    Path.mkdir(target_root, exist_ok=True, parents=True)
+
     # Process files
     if multiprocessing and len(dicom_file_list) > 1:
         # Use parallel processing for multiple files
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            futures = [executor.submit(_ds_to_file, file_path, target_root)
-                       for file_path in dicom_file_list]
-            results = [future.result() for future in futures]
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        # Each worker reads, processes and writes its own files, so while one
+        # waits on disk the others keep computing; batch files into chunks to
+        # amortize IPC over many small tasks
+        chunksize = max(1, len(dicom_file_list) // (max_workers * 4))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                                    initargs=(target_root,)) as executor:
+            results = list(executor.map(_ds_to_file_in_worker, dicom_file_list, chunksize=chunksize))
         print("DICOM images converted to BMP successfully!")
     else:
         # Sequential processing
         results = [_ds_to_file(file_path, target_root) for file_path in dicom_file_list]
 
     # Count successful conversions
-    successful = sum(1 for result in results if result is True)
-    failed = len(results) - successful
+    failures = [result for result in results if result is not None]
+    successful = len(results) - len(failures)
+    failed = len(failures)
 
     if failed > 0:
         print(f"Conversion completed: {successful} successful, {failed} failed")
-        # Print error messages
-        for result in results:
-            if result is not True:
-                print(f"  - {result}")
+        # Print error messages in file order
+        for failure in sorted(failures, key=lambda failure: str(failure[0])):
+            print(f"  - {_error_message(*failure)}")
     else:
         print(f"All {successful} files converted successfully!")
 